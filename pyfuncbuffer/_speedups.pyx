@@ -0,0 +1,67 @@
+# cython: language_level=3
+"""_speedups.pyx - C implementation of the regular buffer.
+
+Copyright (C) 2021 Jupsista
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from libc.limits cimport LLONG_MIN
+from time import monotonic_ns
+from types import MethodType
+
+
+cdef class RegularBuffer:
+    """Callable buffering `func` by `seconds_ns` nanoseconds since its previous call, sleeping with `sleep`.
+
+    Reading and reserving the time of the next allowed call happens without
+    running any Python code in between, so it can't be interrupted by another
+    thread while the GIL is held. This makes the buffer thread safe without
+    a lock: callers in other threads already see the reserved time while
+    this one is sleeping.
+    """
+    cdef object func
+    cdef long long seconds_ns
+    cdef long long next_allowed
+    cdef object sleep
+    # Allows `functools.wraps` to transfer the attributes of `func`
+    cdef dict __dict__
+
+    def __init__(self, func, long long seconds_ns, sleep):
+        self.func = func
+        self.seconds_ns = seconds_ns
+        self.sleep = sleep
+        # Same as `_NEVER` in pyfuncbuffer.py
+        self.next_allowed = LLONG_MIN
+
+    def __call__(self, *args, **kwargs):
+        cdef long long now = monotonic_ns()
+        cdef long long start = self.next_allowed if self.next_allowed > now else now
+        self.next_allowed = start + self.seconds_ns
+        if start > now:
+            self.sleep((start - now) * 1e-9)
+            # As in the Python implementation, the next call is buffered from
+            # when this one actually woke up, unless it has been reserved already
+            if self.next_allowed == start + self.seconds_ns:
+                self.next_allowed = monotonic_ns() + self.seconds_ns
+        return self.func(*args, **kwargs)
+
+    def __reduce__(self):
+        """Pickle by reference like a function, with the `__module__` and `__qualname__` copied from `func`."""
+        return self.__qualname__
+
+    def __get__(self, instance, owner):
+        """Implement the descriptor protocol to make decorating instance methods possible."""
+        if instance is None:
+            return self
+        return MethodType(self, instance)
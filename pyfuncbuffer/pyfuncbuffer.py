@@ -15,13 +15,29 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import asyncio
+from collections import OrderedDict
 import functools
-from multiprocessing import current_process, Lock as mpLock, Manager, Process
-from threading import current_thread, Thread, Lock as tLock
-import random
+from heapq import heapify, heappop, heappush
+import inspect
+from itertools import count
+import sys
+from threading import Lock as tLock
 import time
-from typing import Union, Tuple
+from typing import Callable, Hashable, Union, Tuple
+import weakref
+# asyncio, multiprocessing and random are slow to import and only needed
+# for some of the options, so they are imported when a wrapper needs them
+
+try:
+    from ._speedups import RegularBuffer as _CRegularBuffer
+except ImportError:  # The C implementation is optional
+    _CRegularBuffer = None
+
+
+# Time of next allowed call in nanoseconds for functions that haven't been
+# called yet. It is the smallest 64-bit integer, so that it fits in shared
+# memory. Being a constant, it can also be told apart from stored times by identity
+_NEVER = -2 ** 63
 
 
 # pylint: disable=line-too-long, too-many-statements
@@ -29,7 +45,12 @@ def buffer(seconds: Union[float, int],
            random_delay: Union[float, int, Tuple[Union[float, int], Union[float, int]]] = 0,
            always_buffer: bool = False,
            buffer_on_same_arguments: bool = False,
-           share_buffer: bool = False):
+           share_buffer: bool = False,
+           maxsize: Union[int, None] = 128,
+           thread_safe: bool = True,
+           per_instance: bool = False,
+           precise: bool = False,
+           key_func: Union[Callable[[tuple, dict], Hashable], None] = None):
     """Simple-to-use decorator to buffer function calls.
 
     Parameters:
@@ -50,183 +71,553 @@ def buffer(seconds: Union[float, int],
             Share buffer between processes. This is only useful
             when using multiprocessing, and still wanting to
             have function calls buffered even if called in seperate
-            processes
+            processes. Has no effect on async functions. With
+            `buffer_on_same_arguments` the arguments have to be picklable
+        maxsize: Optional
+            Maximum amount of distinct arguments to remember when
+            `buffer_on_same_arguments` is `True`. The least recently
+            used arguments are forgotten first. `None` means unbounded
+        thread_safe: Optional
+            Make calls from separate threads wait for each other.
+            Can be disabled to skip locking when the function is only
+            called from a single thread. Buffers shared between
+            processes are always locked
+        per_instance: Optional
+            Give every instance its own buffer when decorating an
+            instance method, instead of sharing one between all
+            instances. Buffers are forgotten together with their
+            instance. Has no effect if `share_buffer` is `True`
+        precise: Optional
+            Busy-wait the last millisecond of buffering instead of
+            sleeping, for more accurate timing at the cost of CPU
+            time. Has no effect on async functions
+        key_func: Optional
+            Function returning the key that calls are buffered by
+            when `buffer_on_same_arguments` is `True`. It is given
+            the positional arguments as a tuple and the keyword
+            arguments as a dict. By default the keyword arguments are
+            compared regardless of their order, a cheaper key can be
+            used if they are always passed in the same order
     """
-    # pylint: disable=missing-class-docstring
-    class Buffer:
-        # Store function calls in a dictionary where function is the key
-        # and time of last call is the value. If `share_buffer` is enabled,
-        # then we should use a manager to maintain state across processes
+    if isinstance(random_delay, tuple):
+        random_delay_start, random_delay_end = random_delay
+    else:
+        random_delay_start, random_delay_end = 0, random_delay
+
+    # Times are kept as integer nanoseconds from `time.monotonic_ns`,
+    # which don't lose precision when added together
+    seconds_ns = round(seconds * 1e9)
+    random_delay_start_ns = round(random_delay_start * 1e9)
+    random_delay_end_ns = round(random_delay_end * 1e9)
+
+    # pylint: disable=function-redefined
+    if random_delay_start_ns == random_delay_end_ns:
+        # Nothing has to be drawn if the delay can't vary
+        def get_random_delay(_random_delay=random_delay_start_ns) -> int:
+            """Return the constant random delay in nanoseconds."""
+            return _random_delay
+    else:
+        from random import random  # pylint: disable=import-outside-toplevel
+        random_delay_range_ns = random_delay_end_ns - random_delay_start_ns
+
+        def get_random_delay(_random=random) -> int:
+            """Return random delay in nanoseconds between random_delay_start and random_delay_end."""
+            return random_delay_start_ns + int(random_delay_range_ns * _random())
+
+    sleep = _precise_sleep if precise else time.sleep
+    get_signature = key_func if key_func is not None else _get_signature
+    # Keys from `key_func` are used as they are, so unhashable ones raise TypeError
+    get_unhashable_signature = _get_unhashable_signature if key_func is None else None
+
+    def make_wrapper(func: Callable, is_coroutine: bool,
+                     get_signature: Callable[[tuple, dict], Hashable] = get_signature,
+                     get_unhashable_signature: Union[Callable[[tuple, dict], Hashable], None] = get_unhashable_signature) -> Callable:
+        # Pick the wrapper once here, so that none of the options
+        # have to be checked again when the function is called
+        if is_coroutine:
+            return _make_async_wrapper(func, seconds_ns, get_random_delay, always_buffer,
+                                       buffer_on_same_arguments, get_signature,
+                                       get_unhashable_signature, maxsize)
+        if always_buffer:
+            return _make_always_wrapper(func, seconds_ns, get_random_delay, sleep, thread_safe)
+        if share_buffer and buffer_on_same_arguments:
+            return _make_shared_same_args_wrapper(func, seconds_ns, get_random_delay, sleep, get_signature,
+                                                  get_unhashable_signature)
         if share_buffer:
-            manager = Manager()
-            last_called = manager.dict()
-        else:
-            last_called = {}
-        # Store arguments in adictionary where a set containing the function,
-        # args and kwargs in said order is the key and the value
-        # is the time of last call
-        arguments = {}
-
-        def __init__(self, func):
-            self.original_func = func
-            # This is the value that will be used in `arguments` or `last_called` as a key
-            self.func = id(func)
-            self.seconds = seconds
-            self.always_buffer = always_buffer
-            self.random_delay_start = 0
-            self.random_delay_end = random_delay
-            self.buffer_on_same_arguments = buffer_on_same_arguments
-            self._mp_lock = mpLock()
-            self._t_lock = tLock()
-            self.lock = None
-
-            if asyncio.iscoroutinefunction(self.func):
-                self.is_coroutine = True
-            else:
-                self.is_coroutine = False
-
-            if isinstance(random_delay, tuple):
-                self.random_delay_start = random_delay[0]
-                self.random_delay_end = random_delay[0]
-
-            functools.update_wrapper(self, func)  # Transfer func attributes
-
-        def __call__(self, *args, **kwargs):
-            l_random_delay = self.get_random_delay()
-            # If always buffer is on then this is the only required thing to do
-            self.detect_process_type()
-            if self.always_buffer:
-                if self.is_coroutine:
-                    async def temp():
-                        await asyncio.sleep(self.seconds + l_random_delay)
-                        return await self.original_func(*args, **kwargs)
-                    return temp()
-
-                if self.lock:  # If true, is multiprocess or thread process
-                    with self.lock:
-                        time.sleep(self.seconds + l_random_delay)
-                    return self.original_func(*args, **kwargs)
-
-                time.sleep(self.seconds + l_random_delay)
-                return self.original_func(*args, **kwargs)
-
-            # pylint: disable=no-else-return
-            if self.buffer_on_same_arguments:
-                if self.is_coroutine:
-                    # We have to make a temp function, otherwise we can't return async from a
-                    # non-async function.
-                    async def tmp():
-                        if self.lock:
-                            with self.lock:
-                                return await self.buffer_same_args_async(*args, **kwargs)
-                        return await self.buffer_same_args_async(*args, **kwargs)
-                    return tmp()
-
-                if self.lock:
-                    with self.lock:
-                        return self.buffer_same_args(*args, **kwargs)
-                return self.buffer_same_args(*args, **kwargs)
+            return _make_shared_wrapper(func, seconds_ns, get_random_delay, sleep)
+        if buffer_on_same_arguments:
+            return _make_same_args_wrapper(func, seconds_ns, get_random_delay, sleep, get_signature,
+                                           get_unhashable_signature, maxsize, thread_safe)
+        if _CRegularBuffer is not None and random_delay_start_ns == random_delay_end_ns:
+            # The C implementation is thread safe without a lock
+            return functools.wraps(func)(_CRegularBuffer(func, seconds_ns + random_delay_start_ns, sleep))
+        return _make_regular_wrapper(func, seconds_ns, get_random_delay, sleep, thread_safe)
+
+    def decorator(func: Callable) -> Callable:
+        # This is the only place where `func` is inspected. Per instance
+        # wrappers are made later on, so they reuse the result
+        is_coroutine = inspect.iscoroutinefunction(func)
+        if per_instance and not share_buffer:
+            # The instance is left out of signatures, as buffers
+            # referencing it would keep it alive
+            return _make_instance_wrapper(func, is_coroutine,
+                                          functools.partial(make_wrapper, func, is_coroutine,
+                                                            _without_instance(get_signature),
+                                                            _without_instance(get_unhashable_signature)
+                                                            if get_unhashable_signature is not None else None))
+        return make_wrapper(func, is_coroutine)
+
+    return decorator
+
+
+class _UNHASHABLE:  # pylint: disable=too-few-public-methods
+    """Tags signatures of calls with unhashable arguments.
+
+    Being a class it is pickled by reference, so it stays the same
+    object in other processes, and it can't be passed as an argument by accident.
+    """
+
+
+class _KWARGS:  # pylint: disable=too-few-public-methods
+    """Tags signatures of calls with keyword arguments.
+
+    Otherwise they could be mistaken for the signature of a call with
+    positional arguments, such as `f((1,), frozenset({("a", 2)}))` for `f(1, a=2)`.
+    """
+
+
+def _get_signature(args: tuple, kwargs: dict) -> Hashable:
+    """Return the key used to store a call with `args` and `kwargs`.
+
+    Whether the key is hashable is only found out when it is looked up,
+    in which case `_get_unhashable_signature` should be used instead.
+    """
+    if not kwargs:
+        return args
+    try:
+        return _KWARGS, args, frozenset(kwargs.items())
+    except TypeError:
+        return _get_unhashable_signature(args, kwargs)
+
+
+def _get_unhashable_signature(args: tuple, kwargs: dict) -> tuple:
+    """Return the key used to store a call with unhashable `args` or `kwargs`, such as lists or dicts."""
+    return _UNHASHABLE, repr(args), repr(sorted(kwargs.items()))
+
+
+def _without_instance(get_signature: Callable[[tuple, dict], Hashable]) -> Callable[[tuple, dict], Hashable]:
+    """Return `get_signature` for instance methods, leaving out the instance from the positional arguments."""
+    return lambda args, kwargs: get_signature(args[1:], kwargs)
+
+
+def _forget_expired(arguments: OrderedDict, expiry_heap: list, now: int):
+    """Remove signatures from `arguments` that are allowed to be called again at `now`.
+
+    `expiry_heap` holds a `(next allowed call, counter, signature)` tuple for
+    every time stored in `arguments`, so only the expired ones are looked at.
+    Tuples of times that have since been overwritten or evicted are skipped.
+    """
+    while expiry_heap and expiry_heap[0][0] <= now:
+        next_allowed, _, signature = heappop(expiry_heap)
+        if arguments.get(signature) == next_allowed:
+            del arguments[signature]
+
+
+def _remember(arguments: OrderedDict, expiry_heap: list, counter: count,
+              signature: Hashable, next_allowed: int, maxsize: Union[int, None]):
+    """Store `next_allowed` as the time the next call with `signature` is allowed.
+
+    `signature` becomes the most recently used one, and the least recently
+    used one is forgotten if there are more than `maxsize` stored.
+    """
+    arguments[signature] = next_allowed
+    arguments.move_to_end(signature)
+    heappush(expiry_heap, (next_allowed, next(counter), signature))
+    if maxsize is not None and len(arguments) > maxsize:
+        arguments.popitem(last=False)
+    if len(expiry_heap) > 2 * len(arguments):
+        _compact_expiry_heap(arguments, expiry_heap, counter)
+
+
+def _compact_expiry_heap(arguments: OrderedDict, expiry_heap: list, counter: count):
+    """Rebuild `expiry_heap` from the times stored in `arguments`.
+
+    Tuples of overwritten or evicted times are only skipped once they expire,
+    so without this the heap would grow with every call instead of with `arguments`.
+    """
+    expiry_heap[:] = [(next_allowed, next(counter), signature)
+                      for signature, next_allowed in arguments.items()]
+    heapify(expiry_heap)
+
+
+def _precise_sleep(seconds: float):
+    """Sleep for `seconds`, busy-waiting the last millisecond.
+
+    Sleeping can overshoot by tens of microseconds or more, while
+    busy-waiting on `time.monotonic` returns as soon as the time is up.
+    """
+    end = time.monotonic() + seconds
+    if seconds > 1e-3:
+        time.sleep(seconds - 1e-3)
+    while time.monotonic() < end:
+        pass
+
+
+def _intern_signature(signature: Hashable) -> Hashable:
+    """Return `signature` with its strings interned if it is a tuple only consisting of strings.
+
+    This is only done when a signature is stored for the first time, so that
+    later lookups with interned strings, such as literals, compare by identity.
+    """
+    # pylint: disable=unidiomatic-typecheck
+    if type(signature) is tuple and all(type(arg) is str for arg in signature):
+        return tuple(sys.intern(arg) for arg in signature)
+    return signature
+
+
+def _make_instance_wrapper(func: Callable, is_coroutine: bool, make_wrapper: Callable[[], Callable]) -> Callable:
+    """Return instance method `func` with a separate wrapper from `make_wrapper` for each instance."""
+    # pylint: disable=function-redefined
+    # Instances are told apart by identity, as they may be unhashable or
+    # equal to each other. They are only referenced weakly, so that their
+    # buffers are forgotten together with them before their id can be reused
+    wrappers = {}
+
+    def get_wrapper(instance) -> Callable:
+        instance_wrapper = wrappers.get(id(instance))
+        if instance_wrapper is None:
+            try:
+                weakref.finalize(instance, wrappers.pop, id(instance), None)
+            except TypeError:
+                raise TypeError(f"per_instance requires {type(instance).__name__} instances "
+                                "to support weak references, add '__weakref__' to __slots__") from None
+            instance_wrapper = wrappers.setdefault(id(instance), make_wrapper())
+        return instance_wrapper
+
+    if is_coroutine:
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await get_wrapper(self)(self, *args, **kwargs)
+
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return get_wrapper(self)(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _make_always_wrapper(func: Callable, seconds_ns: int,
+                         get_random_delay: Callable[[], int],
+                         sleep: Callable[[float], None],
+                         thread_safe: bool) -> Callable:
+    """Return `func` buffered by `seconds_ns` nanoseconds on every call."""
+    # pylint: disable=function-redefined
+    if not thread_safe:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sleep((seconds_ns + get_random_delay()) * 1e-9)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    # A multiprocessing lock also works between threads, and makes
+    # calls from forked processes wait for each other too
+    from multiprocessing import Lock  # pylint: disable=import-outside-toplevel
+    lock = Lock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with lock:
+            sleep((seconds_ns + get_random_delay()) * 1e-9)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _make_regular_wrapper(func: Callable, seconds_ns: int,
+                          get_random_delay: Callable[[], int],
+                          sleep: Callable[[float], None],
+                          thread_safe: bool) -> Callable:
+    """Return `func` buffered by `seconds_ns` nanoseconds since its previous call."""
+    # pylint: disable=function-redefined
+    # Looked up on every call, so bound here once
+    monotonic_ns = time.monotonic_ns
+    next_allowed = _NEVER
+
+    if not thread_safe:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal next_allowed
+            now = monotonic_ns()
+            if next_allowed > now:
+                sleep((next_allowed - now) * 1e-9)
+                now = monotonic_ns()
+            next_allowed = now + seconds_ns + get_random_delay()
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    lock = tLock()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal next_allowed
+        with lock:
+            now = monotonic_ns()
+            if next_allowed > now:
+                sleep((next_allowed - now) * 1e-9)
+                now = monotonic_ns()
+            next_allowed = now + seconds_ns + get_random_delay()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _make_same_args_wrapper(func: Callable, seconds_ns: int,
+                            get_random_delay: Callable[[], int],
+                            sleep: Callable[[float], None],
+                            get_signature: Callable[[tuple, dict], Hashable],
+                            get_unhashable_signature: Union[Callable[[tuple, dict], Hashable], None],
+                            maxsize: Union[int, None], thread_safe: bool) -> Callable:
+    """Return `func` buffered by `seconds_ns` nanoseconds since its previous call with the same arguments."""
+    # pylint: disable=function-redefined
+    # Store the time the next call is allowed for each signature in least
+    # recently used order, so that it can be bounded by `maxsize`. Expired
+    # times are forgotten in order of expiry, with the help of a heap
+    arguments = OrderedDict()
+    expiry_heap = []
+    counter = count()
+    monotonic_ns = time.monotonic_ns
+
+    if not thread_safe:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            signature = get_signature(args, kwargs)
+            now = monotonic_ns()
+            if expiry_heap and expiry_heap[0][0] <= now:
+                _forget_expired(arguments, expiry_heap, now)
+            try:
+                next_allowed = arguments.get(signature)
+            except TypeError:
+                if get_unhashable_signature is None:
+                    raise
+                signature = get_unhashable_signature(args, kwargs)
+                next_allowed = arguments.get(signature)
+            if next_allowed is None:
+                signature = _intern_signature(signature)
+            elif next_allowed > now:
+                sleep((next_allowed - now) * 1e-9)
+                now = monotonic_ns()
+            _remember(arguments, expiry_heap, counter, signature,
+                      now + seconds_ns + get_random_delay(), maxsize)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    # Guards `arguments` and `waiting`, and is never held while sleeping
+    lock = tLock()
+    # Calls that have to wait for the same arguments queue behind a lock
+    # of their own, so that calls with other arguments don't wait for them
+    # and only the caller holding it is sleeping. Locks only exist while
+    # there are callers waiting on them, together with the amount of those callers
+    waiting = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        signature = get_signature(args, kwargs)
+        with lock:
+            now = monotonic_ns()
+            if expiry_heap and expiry_heap[0][0] <= now:
+                _forget_expired(arguments, expiry_heap, now)
+            try:
+                next_allowed = arguments.get(signature, _NEVER)
+            except TypeError:
+                if get_unhashable_signature is None:
+                    raise
+                signature = get_unhashable_signature(args, kwargs)
+                next_allowed = arguments.get(signature, _NEVER)
+            entry = waiting.get(signature)
+            if entry is None and next_allowed <= now:
+                if next_allowed is _NEVER:
+                    signature = _intern_signature(signature)
+                _remember(arguments, expiry_heap, counter, signature,
+                          now + seconds_ns + get_random_delay(), maxsize)
             else:
-                if self.is_coroutine:
-                    async def tmp():
-                        if self.lock:
-                            with self.lock:
-                                return await self.buffer_regular_async(*args, **kwargs)
-                            return await self.buffer_regular_async(*args, **kwargs)
-                    return tmp()
-
-                if self.lock:
-                    with self.lock:
-                        return self.buffer_regular(*args, **kwargs)
-                return self.buffer_regular(*args, **kwargs)
-
-        def buffer_same_args(self, *args, **kwargs):
-            """Buffer the function only when `*args` and `**kwargs` are the same."""
-            if not Buffer.arguments:
-                self.add_arguments(*args, **kwargs)
-                return self.original_func(*args, **kwargs)
-
-            time_of_last_call = self.get_last_called_with_args(*args, **kwargs)
-            if not time_of_last_call:
-                self.add_arguments(*args, **kwargs)
-                return self.original_func(*args, **kwargs)
-
-            if not (time.time() - time_of_last_call) > self.seconds:
-                time.sleep(self.get_sleep_time(time_of_last_call))
-
-            self.add_arguments(*args, **kwargs)
-            return self.original_func(*args, **kwargs)
-
-        async def buffer_same_args_async(self, *args, **kwargs):
-            """Buffer the function asynchronously only when `*args` and `**kwargs` are the same."""
-            if not Buffer.arguments:
-                self.add_arguments(*args, **kwargs)
-                return await self.original_func(*args, **kwargs)
-
-            time_of_last_call = self.get_last_called_with_args(*args, **kwargs)
-            if not time_of_last_call:
-                self.add_arguments(*args, **kwargs)
-                return await self.original_func(*args, **kwargs)
-
-            if not (time.time() - time_of_last_call) > self.seconds:
-                await asyncio.sleep(self.get_sleep_time(time_of_last_call))
-
-            self.add_arguments(*args, **kwargs)
-            return await self.original_func(*args, **kwargs)
-
-        def buffer_regular(self, *args, **kwargs):
-            """Buffer self.function depending on self.seconds and random_delay."""
-            l_random_delay = self.get_random_delay()
-            if Buffer.last_called:
-                if not (time.time() - Buffer.last_called.get(self.func)) > self.seconds:
-                    time.sleep(self.get_sleep_time(Buffer.last_called.get(self.func)))
-
-            Buffer.last_called[self.func] = time.time() + l_random_delay
-            return self.original_func(*args, **kwargs)
-
-        async def buffer_regular_async(self, *args, **kwargs):
-            """Buffer self.function asynchronously depending on self.seconds and random_delay."""
-            l_random_delay = self.get_random_delay()
-            if Buffer.last_called:
-                if not (time.time() - Buffer.last_called.get(self.func)) > self.seconds:
-                    await asyncio.sleep(self.get_sleep_time(Buffer.last_called.get(self.func)))
-
-            Buffer.last_called[self.func] = time.time() + l_random_delay
-            return await self.original_func(*args, **kwargs)
-
-        def get_last_called_with_args(self, *args, **kwargs) -> Union[float, None]:
-            """Return time of last call with *args and **kwargs."""
-            return Buffer.arguments.get((self.func, args, frozenset(kwargs.items())))
-
-        def add_arguments(self, *args, **kwargs):
-            """Add arguments to Buffer.arguments object."""
-            Buffer.arguments[(self.func, args, frozenset(kwargs.items()))] = time.time() + self.get_random_delay()
-
-        def get_sleep_time(self, last_called) -> float:
-            """Get the required amount of time to sleep depending on last_called."""
-            return self.seconds - (time.time() - last_called)
-
-        def get_random_delay(self) -> float:
-            """Return random delay specified by self.random_delay_start and self.random_delay_end."""
-            return random.uniform(self.random_delay_start, self.random_delay_end)
-
-        def detect_process_type(self):
-            """Detect the process type(thread or multiprocess process) and set self.lock accordingly."""
-            if not self.lock:
-                if type(current_process()) == Process:  # Is multiprocess process
-                    self.lock = self._mp_lock
-                if type(current_thread()) == Thread:  # Is thread
-                    self.lock = self._t_lock
-
-        # This is required for instance methods to work
-        def __get__(self, instance, instancetype):
-            """Return original function.
-
-            Implement the descriptor protocol to make decorating instance
-            method possible.
-            """
-            # Return a partial function with the first argument is the instance
-            #   of the class decorated.
-            return functools.partial(self.__call__, instance)
-
-    return Buffer
+                if entry is None:
+                    entry = waiting[signature] = [tLock(), 0]
+                entry[1] += 1
+
+        if entry is not None:
+            try:
+                with entry[0]:
+                    # Callers in line before this one have moved the time forward
+                    with lock:
+                        next_allowed = arguments.get(signature, _NEVER)
+                    now = monotonic_ns()
+                    if next_allowed > now:
+                        sleep((next_allowed - now) * 1e-9)
+                        now = monotonic_ns()
+                    with lock:
+                        _remember(arguments, expiry_heap, counter, signature,
+                                  now + seconds_ns + get_random_delay(), maxsize)
+            finally:
+                with lock:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del waiting[signature]
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _make_shared_wrapper(func: Callable, seconds_ns: int,
+                         get_random_delay: Callable[[], int],
+                         sleep: Callable[[float], None]) -> Callable:
+    """Return `func` buffered by `seconds_ns` nanoseconds since its previous call in any process."""
+    # A 64-bit integer in shared memory is enough to maintain state across
+    # processes, and comes with its own lock
+    from multiprocessing import Value  # pylint: disable=import-outside-toplevel
+    next_allowed = Value("q", _NEVER)
+    lock = next_allowed.get_lock()
+    monotonic_ns = time.monotonic_ns
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with lock:
+            now = monotonic_ns()
+            if next_allowed.value > now:
+                sleep((next_allowed.value - now) * 1e-9)
+                now = monotonic_ns()
+            next_allowed.value = now + seconds_ns + get_random_delay()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _make_shared_same_args_wrapper(func: Callable, seconds_ns: int,
+                                   get_random_delay: Callable[[], int],
+                                   sleep: Callable[[float], None],
+                                   get_signature: Callable[[tuple, dict], Hashable],
+                                   get_unhashable_signature: Union[Callable[[tuple, dict], Hashable], None]) -> Callable:
+    """Return `func` buffered by `seconds_ns` nanoseconds since its previous call with the same arguments in any process."""
+    from multiprocessing import Lock, Manager  # pylint: disable=import-outside-toplevel
+    lock = Lock()
+    # Arguments can't be stored in shared memory, so a manager is used
+    # to maintain state across processes. `maxsize` isn't applied here
+    arguments = Manager().dict()
+    monotonic_ns = time.monotonic_ns
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        signature = get_signature(args, kwargs)
+        with lock:
+            try:
+                next_allowed = arguments.get(signature)
+            except TypeError:
+                if get_unhashable_signature is None:
+                    raise
+                signature = get_unhashable_signature(args, kwargs)
+                next_allowed = arguments.get(signature)
+            now = monotonic_ns()
+            if next_allowed is not None and next_allowed > now:
+                sleep((next_allowed - now) * 1e-9)
+                now = monotonic_ns()
+            arguments[signature] = now + seconds_ns + get_random_delay()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _make_async_wrapper(func: Callable, seconds_ns: int,
+                        get_random_delay: Callable[[], int], always_buffer: bool,
+                        buffer_on_same_arguments: bool,
+                        get_signature: Callable[[tuple, dict], Hashable],
+                        get_unhashable_signature: Union[Callable[[tuple, dict], Hashable], None],
+                        maxsize: Union[int, None]) -> Callable:
+    """Return coroutine function `func` buffered according to the options."""
+    # pylint: disable=function-redefined, import-outside-toplevel
+    import asyncio
+    monotonic_ns = time.monotonic_ns
+    if always_buffer:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            await asyncio.sleep((seconds_ns + get_random_delay()) * 1e-9)
+            return await func(*args, **kwargs)
+
+    elif buffer_on_same_arguments:
+        arguments = OrderedDict()
+        expiry_heap = []
+        counter = count()
+        # Calls that have to wait for the same arguments queue behind
+        # a lock, so that only the caller holding it is sleeping. Locks
+        # only exist while there are callers waiting on them, together
+        # with the amount of those callers
+        waiting = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            signature = get_signature(args, kwargs)
+            now = monotonic_ns()
+            if expiry_heap and expiry_heap[0][0] <= now:
+                _forget_expired(arguments, expiry_heap, now)
+            try:
+                next_allowed = arguments.get(signature, _NEVER)
+            except TypeError:
+                if get_unhashable_signature is None:
+                    raise
+                signature = get_unhashable_signature(args, kwargs)
+                next_allowed = arguments.get(signature, _NEVER)
+            entry = waiting.get(signature)
+            if entry is not None or next_allowed > now:
+                if entry is None:
+                    entry = waiting[signature] = [asyncio.Lock(), 0]
+                entry[1] += 1
+                try:
+                    async with entry[0]:
+                        # Callers in line before this one have moved the time forward
+                        next_allowed = arguments.get(signature, _NEVER)
+                        now = monotonic_ns()
+                        if next_allowed > now:
+                            await asyncio.sleep((next_allowed - now) * 1e-9)
+                            now = monotonic_ns()
+                finally:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del waiting[signature]
+            elif next_allowed is _NEVER:
+                signature = _intern_signature(signature)
+            # Nothing is awaited after releasing the lock, so the next
+            # caller in line always sees this update
+            _remember(arguments, expiry_heap, counter, signature,
+                      now + seconds_ns + get_random_delay(), maxsize)
+            return await func(*args, **kwargs)
+
+    else:
+        next_allowed = _NEVER
+        # Same as above, but with a single lock
+        lock, waiting = None, 0
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            nonlocal next_allowed, lock, waiting
+            now = monotonic_ns()
+            if lock is not None or next_allowed > now:
+                if lock is None:
+                    lock = asyncio.Lock()
+                waiting += 1
+                try:
+                    async with lock:
+                        now = monotonic_ns()
+                        if next_allowed > now:
+                            await asyncio.sleep((next_allowed - now) * 1e-9)
+                            now = monotonic_ns()
+                finally:
+                    waiting -= 1
+                    if not waiting:
+                        lock = None
+            next_allowed = now + seconds_ns + get_random_delay()
+            return await func(*args, **kwargs)
+
+    return wrapper
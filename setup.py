@@ -1,13 +1,39 @@
 #!/usr/bin/env python
 
 from distutils.core import setup
-from setuptools import find_packages
+from setuptools import Extension, find_packages
+from setuptools.command.build_ext import build_ext
+
+try:
+    from Cython.Build import cythonize
+    ext_modules = cythonize("pyfuncbuffer/_speedups.pyx")
+except ImportError:
+    # Source distributions include the C source generated by Cython
+    ext_modules = [Extension("pyfuncbuffer._speedups", ["pyfuncbuffer/_speedups.c"])]
+
+
+class OptionalBuildExt(build_ext):
+    """Build the C implementation if possible, pyfuncbuffer works without it."""
+
+    def run(self):
+        try:
+            super().run()
+        except Exception as exception:  # pylint: disable=broad-except
+            print(f"Skipping the C implementation: {exception}")
+
+    def build_extension(self, ext):
+        try:
+            super().build_extension(ext)
+        except Exception as exception:  # pylint: disable=broad-except
+            print(f"Skipping the C implementation: {exception}")
 
 
 setup(
     name='pyfuncbuffer',
     version='0.2.2',
     packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*"]),
+    ext_modules=ext_modules,
+    cmdclass={"build_ext": OptionalBuildExt},
     license='GPLv3',
     description="A library for buffering function calls",
     author="Jupsista",
@@ -16,12 +16,21 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import gc
+import inspect
+from itertools import count
+import pickle
 import time
 from multiprocessing import Queue, Process
 from threading import Thread
+import weakref
 import pytest
 
-from pyfuncbuffer.pyfuncbuffer import buffer
+from pyfuncbuffer.pyfuncbuffer import (buffer, _CRegularBuffer,
+                                       _forget_expired, _remember)
 
 
 # A function shouldn't buffer if it is called only once
@@ -120,6 +129,88 @@ def test_buffer_on_same_arguments_different_args_and_kwargs():
     assert(now + 0.05 > time2)
     time2 = normal_function("foo", arg2="bar")  # Should get buffered
     assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+    # Positional arguments looking like the key of keyword arguments
+    # aren't the same arguments
+    time1 = normal_function(("foo",), frozenset({("arg2", "bar")}))
+    assert(time2 + 0.05 > time1)
+
+
+# Unhashable arguments should still be buffered
+def test_buffer_on_same_arguments_unhashable_args():
+    @buffer(0.1, buffer_on_same_arguments=True)
+    def normal_function(arg1, arg2=None):
+        return time.time()
+
+    now = time.time()
+    time1 = normal_function(["foo"], arg2={"bar": 1})
+    time2 = normal_function(["bar"], arg2={"bar": 1})  # Shouldn't get buffered
+    assert(now + 0.05 > time2)
+    time2 = normal_function(["foo"], arg2={"bar": 1})  # Should get buffered
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+    # Arguments looking like the key of unhashable ones aren't the same
+    time1 = normal_function(repr((["baz"],)), repr([]))  # Not buffered
+    assert(time2 + 0.05 > time1)
+    time1 = normal_function(["baz"])  # Not buffered
+    assert(time2 + 0.05 > time1)
+
+
+# Least recently used arguments should be forgotten past maxsize
+def test_buffer_on_same_arguments_maxsize():
+    @buffer(0.1, buffer_on_same_arguments=True, maxsize=1)
+    def normal_function(arg1):
+        return time.time()
+
+    now = time.time()
+    normal_function("foo")
+    normal_function("bar")
+    time1 = normal_function("foo")  # Forgotten, shouldn't get buffered
+    assert(now + 0.05 > time1)
+    time2 = normal_function("foo")  # Should get buffered
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+# Signatures should be forgotten in order of expiry, and bookkeeping
+# of those times shouldn't outgrow maxsize
+def test_remember_forget_expired():
+    arguments, expiry_heap, counter = OrderedDict(), [], count()
+    for signature in range(1000):
+        # Allowed to be called again at the time of the signature
+        _remember(arguments, expiry_heap, counter, signature, signature, 128)
+    assert(list(arguments) == list(range(872, 1000)))
+    assert(len(expiry_heap) <= 2 * 128 + 1)
+
+    _forget_expired(arguments, expiry_heap, 935)
+    assert(list(arguments) == list(range(936, 1000)))
+    # Overwritten times shouldn't be forgotten by their old expiry
+    _remember(arguments, expiry_heap, counter, 936, 2000, 128)
+    _forget_expired(arguments, expiry_heap, 999)
+    assert(list(arguments) == [936])
+
+
+# Calls should be buffered by the key from key_func
+def test_buffer_on_same_arguments_key_func():
+    @buffer(0.1, buffer_on_same_arguments=True,
+            key_func=lambda args, kwargs: args[0])
+    def normal_function(arg1, arg2):
+        return time.time()
+
+    now = time.time()
+    time1 = normal_function("foo", "bar")
+    time2 = normal_function("bar", "bar")  # Shouldn't get buffered
+    assert(now + 0.05 > time2)
+    time2 = normal_function("foo", "baz")  # Should get buffered
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+# Unhashable keys from key_func shouldn't be replaced by other keys
+def test_buffer_on_same_arguments_unhashable_key_func():
+    @buffer(0.1, buffer_on_same_arguments=True,
+            key_func=lambda args, kwargs: [args[0]])
+    def normal_function(arg1, arg2):
+        return time.time()
+
+    with pytest.raises(TypeError):
+        normal_function("foo", "bar")
 
 
 # A class function shouldn't buffer if it is called only once
@@ -327,6 +418,81 @@ def test_many_instances_off_same_class():
     assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
 
 
+# Instances shouldn't share buffers with per_instance
+def test_many_instances_off_same_class_per_instance():
+    class Class:
+        @buffer(0.1, per_instance=True)
+        def instance_method(self):
+            return time.time()
+
+    instance1 = Class()
+    instance2 = Class()
+
+    now = time.time()
+    instance1.instance_method()
+    time1 = instance2.instance_method()
+    # This shouldn't be buffered
+    assert(now + 0.05 > time1)
+    time2 = instance2.instance_method()
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+# Buffers of instances shouldn't keep them alive
+def test_instance_garbage_collected_per_instance():
+    class Class:
+        @buffer(0.1, buffer_on_same_arguments=True, per_instance=True)
+        def instance_method(self, arg1):
+            return time.time()
+
+    instance = Class()
+    instance.instance_method("foo")
+    instance.instance_method(["foo"])
+    reference = weakref.ref(instance)
+    del instance
+    gc.collect()
+    assert(reference() is None)
+
+
+# Dataclass instances should have their own buffers, even when
+# they are unhashable or equal to each other
+def test_many_dataclass_instances_per_instance():
+    class Base:
+        @buffer(0.1, per_instance=True)
+        def instance_method(self):
+            return time.time()
+
+    @dataclass
+    class Class(Base):
+        name: str
+
+    @dataclass(frozen=True)
+    class FrozenClass(Base):
+        name: str
+
+    for instance1, instance2 in ((Class("foo"), Class("foo")),
+                                 (FrozenClass("foo"), FrozenClass("foo"))):
+        now = time.time()
+        instance1.instance_method()
+        time1 = instance2.instance_method()
+        # This shouldn't be buffered
+        assert(now + 0.05 > time1)
+        time2 = instance2.instance_method()
+        assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+# Instances without weak references can't have their own buffers
+def test_slots_instance_per_instance():
+    class Class:
+        __slots__ = ()
+
+        @buffer(0.1, per_instance=True)
+        def instance_method(self):
+            return time.time()
+
+    with pytest.raises(TypeError, match="weak references"):
+        Class().instance_method()
+
+
 # A staticmethod should be able to be buffered
 def test_staticmethod():
     class Class:
@@ -366,6 +532,90 @@ def test_attributes():
     assert(normal_function.__name__ == "normal_function")
     assert(normal_function.__doc__ == "Example")
     assert(normal_function.__module__ == __name__)
+    assert(normal_function.__wrapped__.__name__ == "normal_function")
+
+
+# Pickling looks buffered functions up by name, so they have to be module level
+@buffer(0.1)
+def module_function():
+    return time.time()
+
+
+# Buffered functions should be pickled by reference like functions
+def test_pickle():
+    assert(pickle.loads(pickle.dumps(module_function)) is module_function)
+
+
+# The C implementation should be used for regular buffers when it is built
+@pytest.mark.skipif(_CRegularBuffer is None,
+                    reason="The C implementation isn't built")
+def test_c_implementation():
+    @buffer(0.1)
+    def normal_function():
+        """Example"""
+        return time.time()
+
+    assert(isinstance(module_function, _CRegularBuffer))
+    assert(isinstance(normal_function, _CRegularBuffer))
+    assert(normal_function.__name__ == "normal_function")
+    assert(normal_function.__doc__ == "Example")
+    time1 = normal_function()
+    time2 = normal_function()
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+# Buffered coroutine functions should still look like coroutine functions
+def test_async_attributes():
+    @buffer(0.1)
+    async def normal_function():
+        pass
+
+    class Class:
+        @buffer(0.1, per_instance=True)
+        async def instance_method(self):
+            pass
+
+    assert(inspect.iscoroutinefunction(normal_function))
+    assert(inspect.iscoroutinefunction(Class.instance_method))
+
+
+# Buffering shouldn't depend on locking
+def test_not_thread_safe_twice():
+    @buffer(0.1, thread_safe=False)
+    def normal_function1():
+        return time.time()
+
+    @buffer(0.1, buffer_on_same_arguments=True, thread_safe=False)
+    def normal_function2(arg1):
+        return time.time()
+
+    time1 = normal_function1()
+    time2 = normal_function1()
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+    time1 = normal_function2("foo")
+    time2 = normal_function2("foo")
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+
+def test_precise_twice():
+    # Buffers are timed with the monotonic clock, which precise
+    # buffering busy-waits on, so it is compared with that too
+    @buffer(0.1, precise=True)
+    def normal_function1():
+        return time.monotonic()
+
+    @buffer(0.0005, precise=True)
+    def normal_function2():
+        return time.monotonic()
+
+    time1 = normal_function1()
+    time2 = normal_function1()
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+
+    time1 = normal_function2()
+    time2 = normal_function2()
+    assert(time2 - time1 > 0.0005 and time2 - time1 < 0.05)
 
 
 # If always buffer is enabled, then the function call should always buffer
@@ -433,6 +683,16 @@ def test_random_delay_twice():
     assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
 
 
+def test_random_delay_range():
+    @buffer(0, (0.1, 0.12), always_buffer=True)
+    def normal_function():
+        return time.time()
+
+    now = time.time()
+    time1 = normal_function()
+    assert(time1 - now > 0.1 and time1 - now < 0.15)
+
+
 # A function shouldn't buffer if it is called only once
 @pytest.mark.asyncio
 async def test_async_normal_function_once():
@@ -458,6 +718,25 @@ async def test_async_normal_function_twice():
     assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
 
 
+# Concurrent calls should be buffered one after another
+@pytest.mark.asyncio
+async def test_async_normal_function_concurrent():
+    @buffer(0.1)
+    async def normal_function1():
+        return time.time()
+
+    @buffer(0.1, buffer_on_same_arguments=True)
+    async def normal_function2(arg1):
+        return time.time()
+
+    times1 = await asyncio.gather(*[normal_function1() for _ in range(3)])
+    times2 = await asyncio.gather(*[normal_function2("foo") for _ in range(3)])
+    for times in (times1, times2):
+        time1, time2, time3 = sorted(times)
+        assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+        assert(time3 - time2 > 0.1 and time3 - time2 < 0.15)
+
+
 # A class function shouldn't buffer if it is called only once
 @pytest.mark.asyncio
 async def test_async_instance_method_once():
@@ -546,6 +825,34 @@ def test_multiprocessing_share_buffer_twice():
            or (time1 - time2 > 0.09 and time1 - time2 < 0.15))
 
 
+# Second process call should be buffered only with the same arguments
+def test_multiprocessing_share_buffer_on_same_arguments_twice():
+    # Arguments are sent to the manager, so the queue can't be one of them
+    q = Queue()
+
+    @buffer(0.1, buffer_on_same_arguments=True, share_buffer=True)
+    def shared_function(arg1):
+        q.put(time.time())
+
+    p1 = Process(target=shared_function, args=("foo",))
+    p2 = Process(target=shared_function, args=("foo",))
+    p1.start()
+    p2.start()
+    time1 = q.get()
+    time2 = q.get()
+    p1.join()
+    p2.join()
+    assert(time2 - time1 > 0.09 and time2 - time1 < 0.15)
+
+    p3 = Process(target=shared_function, args=("bar",))
+    now = time.time()
+    p3.start()
+    time3 = q.get()
+    p3.join()
+    # Different arguments shouldn't be buffered
+    assert(now + 0.05 > time3)
+
+
 # Function should be buffered both times
 def test_multiprocessing_always_buffer_twice():
     @buffer(0.1, always_buffer=True)
@@ -630,6 +937,40 @@ def test_threading_instance_method_twice():
     assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
 
 
+# Threads waiting for other arguments shouldn't buffer each other
+def test_threading_buffer_on_same_arguments_different_args():
+    @buffer(0.1, buffer_on_same_arguments=True)
+    def normal_function(arg1):
+        return time.time()
+
+    normal_function("foo")
+    p1 = Thread(target=normal_function, args=("foo",))  # Gets buffered
+    p1.start()
+    time.sleep(0.02)
+    now = time.time()
+    time1 = normal_function("bar")
+    p1.join()
+    assert(now + 0.05 > time1)
+
+
+# Threads using the same arguments should be buffered one after another
+def test_threading_buffer_on_same_arguments_many_threads():
+    @buffer(0.1, buffer_on_same_arguments=True)
+    def normal_function(q, arg1):
+        q.put(time.time())
+
+    q = Queue()
+    threads = [Thread(target=normal_function, args=(q, "foo"))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    time1, time2, time3 = q.get(), q.get(), q.get()
+    for thread in threads:
+        thread.join()
+    assert(time2 - time1 > 0.1 and time2 - time1 < 0.15)
+    assert(time3 - time2 > 0.1 and time3 - time2 < 0.15)
+
+
 # Function should be buffered both times
 def test_threading_always_buffer_twice():
     @buffer(0.1, always_buffer=True)